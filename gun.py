@@ -1,28 +1,67 @@
+import argparse
 import copy
 import json
 import math
 import os
+import time
 import tkinter as tk
 from abc import ABC, abstractmethod
-from random import choice, randint as rnd
+from random import choice, randint as rnd, uniform
 from tkinter import filedialog, messagebox
 
 import hit_check
+import netcode
+import telemetry
 
 # Time step for delayed jobs
 DT = 30
 VICTORY_MSG_TIME = 3000
 WINDOW_SHAPE = (800, 600)
+# Размер игрового поля. Поле больше окна, в окне видна только его часть,
+# которая следует за пушкой или последним выстрелом.
+ARENA_SHAPE = (2400, 1200)
 MARGIN = 100
+# Число кадров анимации взрыва и наибольшее число одновременных взрывов.
+# При переполнении самые старые взрывы удаляются.
+EXPLOSION_FRAMES = 7
+MAX_EXPLOSIONS = 64
+BALL_RADIUS = 10
+# Длина ствола пушки при нулевой мощности выстрела.
+ZERO_POWER_LENGTH = 20
+# Число шагов таблицы косинусов и синусов, по которой рисуется ствол пушки.
+# Если `None`, косинус и синус вычисляются точно.
+GUN_ANGLE_STEPS = None
+# Законы движения мишеней. Выбираются при создании мишени.
+TARGET_MOTIONS = ('static', 'linear', 'sine', 'orbit')
 
 
 def pass_event(event):
     pass
 
 
+def get_gunpoint(gun_coords, an, power):
+    """Возвращает координаты конца ствола пушки, находящейся в точке
+    `gun_coords`, повернутой на угол `an` и заряженной мощностью `power`.
+    """
+    length = power + ZERO_POWER_LENGTH
+    x = gun_coords[0] + length * math.cos(an)
+    y = gun_coords[1] + length * math.sin(an)
+    return x, y
+
+
+def make_trig_table(steps):
+    """Возвращает список пар `(cos(a), sin(a))` для `steps` углов,
+    равномерно распределенных по окружности начиная с нуля.
+    """
+    return [(math.cos(2 * math.pi * i / steps), math.sin(2 * math.pi * i / steps)) for i in range(steps)]
+
+
 class Agent(ABC):
     def __init__(self):
         self.job = None
+        # Становится истинным в `destroy()`. Уничтоженный агент не должен
+        # оставаться в `BattleField.bullets` и `BattleField.targets`.
+        self.destroyed = False
 
     @abstractmethod
     def start(self):
@@ -50,6 +89,26 @@ class Agent(ABC):
     def update(self):
         pass
 
+    def render_oval(self, moved=True):
+        """Рисует круглый агент, если он попадает в видимую часть поля.
+
+        Элемент холста существует только пока агент виден. Агенты за
+        пределами видимой области продолжают двигаться, но не рисуются.
+        Если агент не сдвинулся (`moved` ложно), а сдвинулась только камера,
+        элемент лишь создается или удаляется на границе видимой области:
+        холст прокручивается целиком, и координаты элемента не меняются.
+        """
+        bbox = (self.x - self.r, self.y - self.r, self.x + self.r, self.y + self.r)
+        if not self.canvas.is_visible(*bbox):
+            if self.id is not None:
+                self.canvas.delete(self.id)
+                self.id = None
+            return
+        if self.id is None:
+            self.id = self.canvas.create_oval(*bbox, fill=self.color)
+        elif moved:
+            self.canvas.coords(self.id, *bbox)
+
 
 class Ball(Agent):
     def __init__(
@@ -61,18 +120,15 @@ class Ball(Agent):
             vy,
             color=None,
             live=None,
-            job_init=None,
-            job_explosion=None
+            job_init=None
     ):
         super().__init__()
         self.job = job_init
-        self.explosion_job = job_explosion
-        self.explosion_level = 0
 
         self.canvas = canvas
         self.x = x
         self.y = y
-        self.r = 10
+        self.r = BALL_RADIUS
         self.jumpiness = 0.7
         self.stop_v = 3
         self.vx = vx
@@ -82,16 +138,12 @@ class Ball(Agent):
         else:
             self.color = color
 
-        self.id = self.canvas.create_oval(
-            self.x - self.r,
-            self.y - self.r,
-            self.x + self.r,
-            self.y + self.r,
-            fill=self.color
-        )
+        self.id = None
+        self.set_coords()
 
         self.live = 100 if live is None else live
-        self.canvas.bullets[self.id] = self
+        self.key = self.canvas.get_agent_key()
+        self.canvas.bullets[self.key] = self
         # Используется для определения номера выстрела, которым уничтожена
         # цель.
         self.bullet_number = self.canvas.get_bullet_number()
@@ -101,24 +153,19 @@ class Ball(Agent):
 
     def play(self):
         super().play()
-        if self.explosion_job == 'pause':
-            self.explosion_job = self.canvas.after(DT, self.destroy)
 
     def stop(self):
         super().stop()
 
     def pause(self):
         super().pause()
-        if self.explosion_job is not None and self.explosion_job != 'pause':
-            self.canvas.after_cancel(self.explosion_job)
-            self.explosion_job = 'pause'
 
     def update(self):
         self.x += self.vx
         self.y -= self.vy
         self.vy -= 1.6
         self.set_coords()
-        if (self.vx ** 2 + self.vy ** 2 < self.stop_v ** 2) and (WINDOW_SHAPE[1] - MARGIN - self.y < 5):
+        if (self.vx ** 2 + self.vy ** 2 < self.stop_v ** 2) and (ARENA_SHAPE[1] - MARGIN - self.y < 5):
             self.destroy()
             return
         self.hit_targets()
@@ -126,51 +173,41 @@ class Ball(Agent):
             self.vx *= -self.jumpiness
             self.vy *= self.jumpiness
             self.x = 2 * MARGIN - self.x
-        if self.x > WINDOW_SHAPE[0] - MARGIN:
+        if self.x > ARENA_SHAPE[0] - MARGIN:
             self.vx *= -self.jumpiness
             self.vy *= self.jumpiness
-            self.x = 2 * (WINDOW_SHAPE[0] - MARGIN) - self.x
-        if self.y > WINDOW_SHAPE[1] - MARGIN:
+            self.x = 2 * (ARENA_SHAPE[0] - MARGIN) - self.x
+        if self.y > ARENA_SHAPE[1] - MARGIN:
             self.vx *= self.jumpiness
             self.vy += 1.8
             self.vy *= -self.jumpiness
             if abs(self.vy) < self.stop_v:
                 self.vy = 0
-            self.y = 2 * (WINDOW_SHAPE[1] - MARGIN) - self.y
+            self.y = 2 * (ARENA_SHAPE[1] - MARGIN) - self.y
         self.job = self.canvas.after(DT, self.update)
 
     def destroy(self):
-        if self.explosion_level == 0:
-            del self.canvas.bullets[self.id]
-            self.color = 'yellow'
-        if self.explosion_level < 7:
-            self.r = 4.6 * self.explosion_level
-            self.y -= 3.6
-            self.set_coords()
-            self.explosion_level += 1
-            self.explosion_job = self.canvas.after(DT, self.destroy)
-            return
-        self.explosion_job = None
+        self.destroyed = True
         self.stop()
-        self.canvas.delete(self.id)
+        del self.canvas.bullets[self.key]
+        if self.id is not None:
+            self.canvas.delete(self.id)
+            self.id = None
+        self.canvas.explosions.add(self.x, self.y)
 
     def set_coords(self):
-        self.canvas.coords(
-            self.id,
-            self.x - self.r,
-            self.y - self.r,
-            self.x + self.r,
-            self.y + self.r
-        )
-        self.canvas.itemconfig(self.id, fill=self.color)
+        self.render_oval()
 
     def hit_targets(self):
         ids_hit = []
         for t_id, t in list(self.canvas.targets.items()):
+            # Смещение пули за последний такт в системе отсчета мишени,
+            # взятое с обратным знаком. Ось `y` холста направлена вниз, а
+            # `self.vy` -- вверх.
             if hit_check.is_hit(
                     (self.x, self.y),
                     self.r,
-                    (-self.vx, -self.vy),
+                    (t.vx - self.vx, t.vy + self.vy),
                     (t.x, t.y),
                     t.r
             ):
@@ -187,8 +224,7 @@ class Ball(Agent):
             'vy': self.vy,
             'color': self.color,
             'live': self.live,
-            'job': self.job is not None,
-            'job_explosion': self.explosion_job is not None
+            'job': self.job is not None
         }
         return state
 
@@ -201,18 +237,28 @@ class Gun(Agent):
         self.gun_power_gain = 1
         self.min_gun_power = 10
         self.max_gun_power = 70
-        self.zero_power_length = 20
 
-        self.gun_coords = [MARGIN + 20, WINDOW_SHAPE[1] * 0.66]
+        self.gun_coords = [MARGIN + 20, ARENA_SHAPE[1] * 0.66]
         self.vy = 0
         self.mouse_coords = [None, None]
         self.f2_power = 10
         self.f2_on = 0
         self.an = 1
 
+        # Запомненные результаты вычислений. Угол пересчитывается, только
+        # если сдвинулась мышь или пушка, конец ствола -- если изменились
+        # положение, угол или мощность. Элемент холста обновляется, только
+        # если изменилась его геометрия или цвет.
+        self.angle_key = None
+        self.gunpoint_key = None
+        self.gunpoint = None
+        self.drawn_key = None
+        self.drawn_color = None
+        self.trig_table = None if GUN_ANGLE_STEPS is None else make_trig_table(GUN_ANGLE_STEPS)
+
         self.canvas = canvas
-        self.id = self.canvas.create_line(
-            *self.gun_coords, *self.get_gunpoint(), width=7)
+        self.id = None
+        self.redraw()
 
         self.job = None
 
@@ -226,6 +272,10 @@ class Gun(Agent):
         super().play()
 
     def stop(self):
+        # У спящей пушки (см. `Gun.update()`) нет отложенного задания,
+        # которое нужно отменять.
+        if self.job == 'idle':
+            self.job = None
         super().stop()
         self.unbind_all()
         self.vy = 0
@@ -234,6 +284,8 @@ class Gun(Agent):
         self.mouse_coords = [None, None]
 
     def pause(self):
+        if self.job == 'idle':
+            self.job = 'pause'
         super().pause()
         self.unbind_all()
         self.mouse_coords = [None, None]
@@ -241,18 +293,36 @@ class Gun(Agent):
     def update(self):
         if self.f2_on and (self.f2_power < self.max_gun_power):
             self.f2_power += self.gun_power_gain
-        if WINDOW_SHAPE[1] / 2 <= self.gun_coords[1] <= WINDOW_SHAPE[1] - MARGIN:
+        if ARENA_SHAPE[1] / 2 <= self.gun_coords[1] <= ARENA_SHAPE[1] - MARGIN:
             self.gun_coords[1] += self.vy
-        elif self.gun_coords[1] > WINDOW_SHAPE[1] - MARGIN:
-            self.gun_coords[1] = WINDOW_SHAPE[1] - MARGIN
-        elif self.gun_coords[1] < WINDOW_SHAPE[1] / 2:
-            self.gun_coords[1] = WINDOW_SHAPE[1] / 2
+        elif self.gun_coords[1] > ARENA_SHAPE[1] - MARGIN:
+            self.gun_coords[1] = ARENA_SHAPE[1] - MARGIN
+        elif self.gun_coords[1] < ARENA_SHAPE[1] / 2:
+            self.gun_coords[1] = ARENA_SHAPE[1] / 2
         self.update_angle()
         self.redraw()
-        self.job = self.canvas.after(DT, self.update)
+        if self.f2_on or self.vy:
+            self.job = self.canvas.after(DT, self.update)
+        else:
+            # Пушке нечего делать, пока игрок не сдвинет мышь, не нажмет
+            # клавишу или кнопку мыши или не сдвинется камера. Задание не
+            # перезапускается, его возобновит `Gun.wake()`.
+            self.job = 'idle'
+
+    def wake(self):
+        """Возобновляет обновление пушки, остановленное в `Gun.update()`,
+        так как пушка не менялась. На паузе и после остановки ничего не
+        делает.
+        """
+        if self.job == 'idle':
+            self.job = self.canvas.after(DT, self.update)
 
     def update_angle(self):
         self.mouse_coords = self.canvas.get_mouse_coords()
+        key = (*self.mouse_coords, *self.gun_coords)
+        if key == self.angle_key:
+            return
+        self.angle_key = key
         dx = self.mouse_coords[0] - self.gun_coords[0]
         dy = self.mouse_coords[1] - self.gun_coords[1]
         if dx != 0:
@@ -261,32 +331,66 @@ class Gun(Agent):
             self.an = 1
 
     def get_gunpoint(self):
-        length = self.f2_power + self.zero_power_length
-        x = self.gun_coords[0] + length * math.cos(self.an)
-        y = self.gun_coords[1] + length * math.sin(self.an)
-        return x, y
+        key = (*self.gun_coords, self.an, self.f2_power)
+        if key == self.gunpoint_key:
+            return self.gunpoint
+        self.gunpoint_key = key
+        if self.trig_table is None:
+            self.gunpoint = get_gunpoint(self.gun_coords, self.an, self.f2_power)
+        else:
+            steps = len(self.trig_table)
+            cos_an, sin_an = self.trig_table[round(self.an * steps / (2 * math.pi)) % steps]
+            length = self.f2_power + ZERO_POWER_LENGTH
+            self.gunpoint = (self.gun_coords[0] + length * cos_an, self.gun_coords[1] + length * sin_an)
+        return self.gunpoint
 
     def redraw(self):
-        self.canvas.coords(self.id, *self.gun_coords, *self.get_gunpoint())
-        if self.f2_on:
-            self.canvas.itemconfig(self.id, fill='orange')
-        else:
-            self.canvas.itemconfig(self.id, fill='black')
+        """Перерисовывает пушку. Если пушка не изменилась, холст не
+        затрагивается.
+        """
+        gunpoint = self.get_gunpoint()
+        if not self.canvas.is_visible(
+                min(self.gun_coords[0], gunpoint[0]),
+                min(self.gun_coords[1], gunpoint[1]),
+                max(self.gun_coords[0], gunpoint[0]),
+                max(self.gun_coords[1], gunpoint[1])
+        ):
+            if self.id is not None:
+                self.canvas.delete(self.id)
+                self.id = None
+            return
+        color = 'orange' if self.f2_on else 'black'
+        if self.id is None:
+            self.id = self.canvas.create_line(*self.gun_coords, *gunpoint, width=7, fill=color)
+            self.drawn_key = self.gunpoint_key
+            self.drawn_color = color
+            return
+        if self.drawn_key != self.gunpoint_key:
+            self.canvas.coords(self.id, *self.gun_coords, *gunpoint)
+            self.drawn_key = self.gunpoint_key
+        if self.drawn_color != color:
+            self.canvas.itemconfig(self.id, fill=color)
+            self.drawn_color = color
 
     def fire2_start(self, event):
         self.f2_on = 1
+        self.wake()
 
     def fire2_end(self, event):
         self.f2_on = 0
         b = Ball(self.canvas, *self.gun_coords, self.f2_power * math.cos(self.an), - self.f2_power * math.sin(self.an))
         b.start()
+        self.canvas.report_shot(b, self.f2_power, self.an)
         self.f2_power = self.min_gun_power
+        self.wake()
 
     def set_movement_direction_to_up(self, event):
         self.vy = -self.gun_velocity
+        self.wake()
 
     def set_movement_direction_to_down(self, event):
         self.vy = self.gun_velocity
+        self.wake()
 
     def stop_movement(self, event):
         self.vy = 0
@@ -328,13 +432,26 @@ class Gun(Agent):
         self.f2_on = state['f2_on']
         self.an = state['an']
         self.job = job_init if state['job'] else None
+        self.angle_key = None
 
 
 class Target(Agent):
-    def __init__(self, canvas: tk.Canvas, x=None, y=None, r=None, color=None, job_init=None):
+    def __init__(
+            self,
+            canvas: tk.Canvas,
+            x=None,
+            y=None,
+            r=None,
+            color=None,
+            motion=None,
+            vx=None,
+            vy=None,
+            anchor=None,
+            amplitude=None,
+            omega=None,
+            phase=None
+    ):
         super().__init__()
-        self.x = rnd(WINDOW_SHAPE[0] * 0.4, WINDOW_SHAPE[0] - MARGIN) if (x is None) else x
-        self.y = rnd(WINDOW_SHAPE[1] * 0.4, WINDOW_SHAPE[1] - MARGIN) if (y is None) else y
         self.r = rnd(10, 20) if (r is None) else r
         self.canvas = canvas
         if color is None:
@@ -342,69 +459,282 @@ class Target(Agent):
         else:
             self.color = color
 
-        self.id = self.canvas.create_oval(
-            self.x - self.r,
-            self.y - self.r,
-            self.x + self.r,
-            self.y + self.r,
-            fill=self.color
-        )
+        self.motion = choice(TARGET_MOTIONS) if motion is None else motion
+        periodic = self.motion in ('sine', 'orbit')
+        # Центр колебаний или орбиты, амплитуда (радиус орбиты), угловая
+        # скорость в радианах за такт и текущая фаза.
+        if amplitude is None:
+            amplitude = rnd(20, 60) if periodic else 0
+        self.amplitude = amplitude
+        if omega is None:
+            omega = choice([-1, 1]) * uniform(0.03, 0.1) if periodic else 0
+        self.omega = omega
+        self.phase = uniform(0, 2 * math.pi) if phase is None else phase
+
+        # Мишень выбирается так, чтобы она целиком оставалась в полосе
+        # появления мишеней на всем пути движения. Иначе в части периода
+        # мишень уходит за стену или под пол и в нее нельзя попасть.
+        x_margin = self.r + (self.amplitude if self.motion == 'orbit' else 0)
+        y_margin = self.r + self.amplitude
+        if x is None:
+            x = rnd(int(ARENA_SHAPE[0] * 0.4) + x_margin, ARENA_SHAPE[0] - MARGIN - x_margin)
+        if y is None:
+            y = rnd(int(ARENA_SHAPE[1] * 0.4) + y_margin, ARENA_SHAPE[1] - MARGIN - y_margin)
+        self.x = x
+        self.y = y
 
-        self.canvas.targets[self.id] = self
-        self.job = job_init
+        # `vx` и `vy` -- смещение мишени за один такт в координатах холста.
+        # Для линейного движения это параметры движения, для остальных
+        # законов они пересчитываются на каждом такте.
+        if self.motion == 'linear':
+            self.vx = uniform(-3, 3) if vx is None else vx
+            self.vy = uniform(-3, 3) if vy is None else vy
+        else:
+            self.vx = 0 if vx is None else vx
+            self.vy = 0 if vy is None else vy
+        if anchor is None:
+            self.anchor = (self.x, self.y)
+            if periodic:
+                self.x, self.y = self.get_periodic_position()
+        else:
+            self.anchor = tuple(anchor)
+
+        self.id = None
+        self.set_coords()
+
+        self.key = self.canvas.get_agent_key()
+        self.canvas.targets[self.key] = self
 
+    # У мишеней нет собственных отложенных задач: все мишени сдвигаются за
+    # один проход в `BattleField.tick()`.
     def start(self):
-        super().start()
+        pass
 
     def play(self):
-        super().play()
+        pass
 
     def stop(self):
-        super().stop()
+        pass
 
     def pause(self):
-        super().pause()
+        pass
 
     def update(self):
-        self.job = self.canvas.after(DT, self.update)
+        """Сдвигает мишень на один такт в соответствии с законом движения
+        `self.motion`.
+        """
+        if self.motion == 'linear':
+            self.x += self.vx
+            self.y += self.vy
+            if not ARENA_SHAPE[0] * 0.4 + self.r <= self.x <= ARENA_SHAPE[0] - MARGIN - self.r:
+                self.vx *= -1
+                self.x += 2 * self.vx
+            if not ARENA_SHAPE[1] * 0.4 + self.r <= self.y <= ARENA_SHAPE[1] - MARGIN - self.r:
+                self.vy *= -1
+                self.y += 2 * self.vy
+        elif self.motion in ('sine', 'orbit'):
+            self.phase += self.omega
+            x, y = self.get_periodic_position()
+            self.vx = x - self.x
+            self.vy = y - self.y
+            self.x, self.y = x, y
+        else:
+            if self.canvas.view_moved:
+                self.render_oval(moved=False)
+            return
+        self.set_coords()
+
+    def get_periodic_position(self):
+        if self.motion == 'sine':
+            return self.anchor[0], self.anchor[1] + self.amplitude * math.sin(self.phase)
+        return (
+            self.anchor[0] + self.amplitude * math.cos(self.phase),
+            self.anchor[1] + self.amplitude * math.sin(self.phase)
+        )
+
+    def set_coords(self):
+        self.render_oval()
 
     def destroy(self):
-        self.stop()
-        self.canvas.delete(self.id)
-        del self.canvas.targets[self.id]
+        self.destroyed = True
+        if self.id is not None:
+            self.canvas.delete(self.id)
+            self.id = None
+        del self.canvas.targets[self.key]
 
     def get_state(self):
         state = {
-            'job': self.job is not None,
             'x': self.x,
             'y': self.y,
             'r': self.r,
-            'color': self.color
+            'color': self.color,
+            'motion': self.motion,
+            'vx': self.vx,
+            'vy': self.vy,
+            'anchor': self.anchor,
+            'amplitude': self.amplitude,
+            'omega': self.omega,
+            'phase': self.phase
+        }
+        return state
+
+
+class Explosions(Agent):
+    """Все анимации взрывов на поле.
+
+    Взрывы хранятся в одном списке и продвигаются на кадр за один проход
+    одним отложенным заданием. Элементы холста закончившихся взрывов
+    скрываются и используются повторно.
+    """
+    def __init__(self, canvas):
+        super().__init__()
+        self.canvas = canvas
+        # Каждый взрыв -- список `[x, y, level, id]`, где `id` -- элемент
+        # холста или `None`, если взрыв вне видимой области.
+        self.effects = []
+        self.free_ids = []
+        self.color = 'yellow'
+
+    def start(self):
+        if self.effects:
+            super().start()
+
+    def play(self):
+        super().play()
+
+    def stop(self):
+        super().stop()
+
+    def pause(self):
+        super().pause()
+
+    def add(self, x, y):
+        if len(self.effects) >= MAX_EXPLOSIONS:
+            self.release(self.effects.pop(0))
+        effect = [x, y, 0, None]
+        self.effects.append(effect)
+        self.advance(effect)
+        if self.job is None:
+            self.job = self.canvas.after(DT, self.update)
+
+    def update(self):
+        alive = []
+        for effect in self.effects:
+            if effect[2] < EXPLOSION_FRAMES:
+                self.advance(effect)
+                alive.append(effect)
+            else:
+                self.release(effect)
+        self.effects = alive
+        if self.effects:
+            self.job = self.canvas.after(DT, self.update)
+        else:
+            self.job = None
+
+    def advance(self, effect):
+        """Рисует очередной кадр взрыва: шар растет и поднимается."""
+        effect[1] -= 3.6
+        self.draw(effect, 4.6 * effect[2])
+        effect[2] += 1
+
+    def draw(self, effect, r):
+        x, y, _, item_id = effect
+        bbox = (x - r, y - r, x + r, y + r)
+        if self.canvas.is_visible(*bbox):
+            if item_id is None:
+                if self.free_ids:
+                    item_id = self.free_ids.pop()
+                    self.canvas.itemconfig(item_id, state='normal')
+                else:
+                    item_id = self.canvas.create_oval(*bbox, fill=self.color)
+            self.canvas.coords(item_id, *bbox)
+        elif item_id is not None:
+            self.release(effect)
+            item_id = None
+        effect[3] = item_id
+
+    def show(self, effects):
+        """Рисует взрывы `effects` из состояния, полученного от сервера,
+        не продвигая их анимацию.
+        """
+        self.clear()
+        self.effects = [[x, y, level, None] for x, y, level in effects]
+        for effect in self.effects:
+            # `level` -- номер следующего кадра взрыва.
+            self.draw(effect, 4.6 * max(effect[2] - 1, 0))
+
+    def release(self, effect):
+        if effect[3] is not None:
+            self.canvas.itemconfig(effect[3], state='hidden')
+            self.free_ids.append(effect[3])
+            effect[3] = None
+
+    def clear(self):
+        for effect in self.effects:
+            self.release(effect)
+        self.effects = []
+
+    def get_state(self):
+        state = {
+            'effects': [effect[:3] for effect in self.effects],
+            'job': self.job is not None
         }
         return state
 
+    def set_state(self, state, job_init):
+        self.clear()
+        self.effects = [[x, y, level, None] for x, y, level in state['effects']]
+        self.job = job_init if state['job'] else None
+
 
 class BattleField(tk.Canvas):
     def __init__(self, master):
-        super().__init__(master, background='white')
+        super().__init__(
+            master, background='white', scrollregion=(0, 0, *ARENA_SHAPE))
 
         self.num_targets = 4
 
-        self.gun = Gun(self)
+        # Видимая часть поля `[x0, y0, x1, y1]` в координатах поля.
+        # Совпадает с координатами холста, так как холст прокручивается
+        # вместе с камерой.
+        self.view = [0, 0, *WINDOW_SHAPE]
+        self.view_moved = False
+        self.agent_counter = 0
+
         self.targets = {}
         self.bullets = {}
+        self.gun = Gun(self)
+        self.explosions = Explosions(self)
         self.boundaries = ()
 
+        # Положение указателя мыши в координатах окна холста. Обновляется
+        # событиями `<Motion>` и `<Leave>`, чтобы не опрашивать Tk на каждом
+        # такте. Когда окно появляется на экране, положение указателя
+        # запрашивается у Tk один раз.
+        self.pointer = [0, 0]
+        self.bind('<Motion>', self.on_motion)
+        self.bind('<Leave>', self.on_motion)
+        self.bind('<Map>', self.on_map)
+
         # Переменная для присвоения номеров выпущенным пулям.
         # Номера используются для определения, каким по счету выстрелом была
         # уничтожена цель. Отсчет начинается с единицы.
         self.bullet_counter = 0
         self.last_hit_bullet_number = None
+        # Номер такта раунда. Используется в телеметрии.
+        self.tick_counter = 0
         self.victory_text_id = self.create_text(
             WINDOW_SHAPE[0] // 2, WINDOW_SHAPE[1] // 2, text='', font='28')
 
         self.catch_victory_job = None
         self.canvas_restart_job = None
+        self.tick_job = None
+
+        # Режим клиента, см. `BattleField.connect()`.
+        self.client = None
+        self.remote_job = None
+        self.remote_items = {'targets': {}, 'bullets': {}}
+        self.last_aim = None
 
     def remove_targets(self, targets_to_remove=None):
         if targets_to_remove is None:
@@ -427,20 +757,25 @@ class BattleField(tk.Canvas):
     def create_targets_from_states(self, states, job_init):
         states = copy.deepcopy(states)
         for state in states:
-            job_active = state.pop('job')
-            Target(self, **state, job_init=job_init if job_active else None)
+            # Ключ `'job'` есть в сохранениях, сделанных до того, как мишени
+            # стали двигаться из `BattleField.tick()`.
+            state.pop('job', None)
+            state.setdefault('motion', 'static')
+            Target(self, **state)
 
     def create_bullets_from_states(self, states, job_init):
         states = copy.deepcopy(states)
         for state in states:
             job_active = state.pop('job')
+            state.pop('job_explosion', None)
             Ball(self, **state, job_init=job_init if job_active else None)
 
     def start(self):
         self.catch_victory_job = self.after(DT, self.catch_victory)
+        if (self.tick_job is None) or (self.tick_job == 'pause'):
+            self.tick_job = self.after(DT, self.tick)
         self.gun.start()
-        for t in self.targets.values():
-            t.start()
+        self.explosions.start()
         for b in self.bullets.values():
             b.start()
 
@@ -450,11 +785,14 @@ class BattleField(tk.Canvas):
         if self.canvas_restart_job == 'pause':
             self.canvas_restart_job = self.after(
                 VICTORY_MSG_TIME, self.restart)
+        if self.tick_job == 'pause':
+            self.tick_job = self.after(DT, self.tick)
 
     def play(self):
         """Продолжить игру после паузы."""
         self.play_jobs()
         self.gun.play()
+        self.explosions.play()
         for bullet in self.bullets.values():
             bullet.play()
 
@@ -468,7 +806,11 @@ class BattleField(tk.Canvas):
         if self.canvas_restart_job is not None:
             self.after_cancel(self.canvas_restart_job)
             self.canvas_restart_job = None
+        if self.tick_job is not None:
+            self.after_cancel(self.tick_job)
+            self.tick_job = None
         self.gun.stop()
+        self.explosions.stop()
         for bullet in self.bullets.values():
             bullet.stop()
 
@@ -479,20 +821,27 @@ class BattleField(tk.Canvas):
         if self.canvas_restart_job is not None:
             self.after_cancel(self.canvas_restart_job)
             self.canvas_restart_job = 'pause'
+        if self.tick_job is not None:
+            self.after_cancel(self.tick_job)
+            self.tick_job = 'pause'
 
     def pause(self):
         """Поставить поле боя на паузу."""
         self.pause_jobs()
         self.gun.pause()
+        self.explosions.pause()
         for bullet in self.bullets.values():
             bullet.pause()
 
     def restart(self):
         self.remove_bullets()
         self.remove_targets()
+        self.explosions.stop()
+        self.explosions.clear()
         self.create_targets()
         self.bullet_counter = 0
         self.last_hit_bullet_number = None
+        self.tick_counter = 0
         self.itemconfig(self.victory_text_id, text='')
         self.start()
 
@@ -502,14 +851,71 @@ class BattleField(tk.Canvas):
             root = root.master
         return root
 
+    def on_motion(self, event):
+        self.pointer = [event.x, event.y]
+        self.gun.wake()
+
+    def on_map(self, event):
+        pointer_x, pointer_y = self.winfo_pointerxy()
+        self.pointer = [pointer_x - self.winfo_rootx(), pointer_y - self.winfo_rooty()]
+        self.gun.wake()
+
     def get_mouse_coords(self):
-        abs_x = self.winfo_pointerx()
-        abs_y = self.winfo_pointery()
-        canvas_x = self.winfo_rootx()
-        canvas_y = self.winfo_rooty()
-        return [abs_x - canvas_x, abs_y - canvas_y]
+        """Возвращает координаты указателя мыши в координатах поля.
+
+        Используется последнее положение указателя над холстом или точка,
+        в которой он покинул холст: пока указатель вне окна, пушка не
+        поворачивается за ним.
+        """
+        return [self.view[0] + self.pointer[0], self.view[1] + self.pointer[1]]
+
+    def get_agent_key(self):
+        """Возвращает ключ для словарей `self.targets` и `self.bullets`.
+
+        Идентификаторы элементов холста для этого не подходят: у агентов
+        вне видимой области элементов холста нет.
+        """
+        self.agent_counter += 1
+        return self.agent_counter
+
+    def is_visible(self, x0, y0, x1, y1):
+        return x1 >= self.view[0] and x0 <= self.view[2] and y1 >= self.view[1] and y0 <= self.view[3]
+
+    def get_camera_target(self):
+        """Камера следует за последним выпущенным снарядом, а если
+        снарядов нет -- за пушкой.
+        """
+        if self.bullets:
+            newest = max(self.bullets.values(), key=lambda b: b.bullet_number)
+            return newest.x, newest.y
+        return self.gun.gun_coords
+
+    def follow_camera(self, target=None):
+        """Прокручивает холст так, чтобы цель камеры `target` (по умолчанию
+        `self.get_camera_target()`) была в центре видимой области, не
+        выходя за пределы поля.
+        """
+        width = max(self.winfo_width(), 1)
+        height = max(self.winfo_height(), 1)
+        x, y = self.get_camera_target() if target is None else target
+        x0 = min(max(x - width / 2, 0), max(ARENA_SHAPE[0] - width, 0))
+        y0 = min(max(y - height / 2, 0), max(ARENA_SHAPE[1] - height, 0))
+        self.xview_moveto(x0 / ARENA_SHAPE[0])
+        self.yview_moveto(y0 / ARENA_SHAPE[1])
+        view = [self.canvasx(0), self.canvasy(0), self.canvasx(width), self.canvasy(height)]
+        self.view_moved = view != self.view
+        self.view = view
+
+    def center_victory_text(self):
+        """Помещает текст победы в центр видимой области."""
+        self.coords(
+            self.victory_text_id,
+            (self.view[0] + self.view[2]) / 2,
+            (self.view[1] + self.view[3]) / 2
+        )
 
     def show_victory_text(self):
+        self.center_victory_text()
         self.itemconfig(self.victory_text_id, text='Game over! {} shots spent.'.format(self.bullet_counter))
 
     def catch_victory(self):
@@ -518,14 +924,106 @@ class BattleField(tk.Canvas):
         """
         if not self.targets:
             self.show_victory_text()
+            self.master.report_round_end()
             self.canvas_restart_job = self.after(VICTORY_MSG_TIME, self.master.new_game)
         else:
             self.catch_victory_job = self.after(DT, self.catch_victory)
 
+    def tick(self):
+        """Сдвигает камеру и все мишени за один такт одним отложенным
+        заданием, вместо отдельного задания для каждой мишени.
+        """
+        self.tick_counter += 1
+        self.follow_camera()
+        if self.view_moved:
+            # Указатель мыши сдвинулся относительно поля.
+            self.gun.wake()
+            # Камера продолжает следить за летящими снарядами и после
+            # победы, текст победы должен оставаться на экране.
+            if not self.targets:
+                self.center_victory_text()
+        for t in self.targets.values():
+            t.update()
+        self.tick_job = self.after(DT, self.tick)
+
+    def connect(self, client):
+        """Переводит поле в режим клиента.
+
+        Игра моделируется сервером (см. `server.py`), а поле только рисует
+        полученное от сервера состояние и передает серверу действия игрока.
+
+        Args:
+            client (`netcode.ClientThread`): Подключение к серверу.
+        """
+        self.client = client
+        self.bind('<Button-1>', lambda event: client.send_input('fire_start'))
+        self.bind('<ButtonRelease-1>', lambda event: client.send_input('fire_end'))
+        root = self.get_root()
+        root.bind('<Up>', lambda event: client.send_input('up'))
+        root.bind('<KeyRelease-Up>', lambda event: client.send_input('stop'))
+        root.bind('<Down>', lambda event: client.send_input('down'))
+        root.bind('<KeyRelease-Down>', lambda event: client.send_input('stop'))
+        self.remote_job = self.after(DT, self.show_remote_state)
+
+    def show_remote_state(self):
+        closed = self.client.closed
+        snapshot = self.client.snapshot
+        if snapshot is not None:
+            self.show_snapshot(snapshot)
+        if closed:
+            # Сервер закрыл соединение: последнее состояние остается на
+            # экране, а поверх него выводится сообщение.
+            self.remote_job = None
+            self.center_victory_text()
+            self.itemconfig(self.victory_text_id, text='Connection to the server is lost.')
+            return
+        aim = self.get_mouse_coords()
+        if aim != self.last_aim:
+            self.client.send_input('aim', x=aim[0], y=aim[1])
+            self.last_aim = aim
+        self.remote_job = self.after(DT, self.show_remote_state)
+
+    def show_snapshot(self, snapshot):
+        """Рисует состояние `snapshot`, полученное от сервера.
+
+        Рисуются только попадающие в видимую область мишени и снаряды.
+        """
+        bullets = snapshot['bullets']
+        if bullets:
+            newest = bullets[max(bullets, key=int)]
+            self.follow_camera((newest['x'], newest['y']))
+        else:
+            self.follow_camera(snapshot['gun']['gun_coords'])
+        self.gun.set_state(snapshot['gun'], None)
+        self.gun.redraw()
+        for section in ('targets', 'bullets'):
+            items = self.remote_items[section]
+            for key in list(items):
+                if key not in snapshot[section]:
+                    self.delete(items.pop(key))
+            for key, agent in snapshot[section].items():
+                r = agent.get('r', BALL_RADIUS)
+                bbox = (agent['x'] - r, agent['y'] - r, agent['x'] + r, agent['y'] + r)
+                if not self.is_visible(*bbox):
+                    if key in items:
+                        self.delete(items.pop(key))
+                elif key in items:
+                    self.coords(items[key], *bbox)
+                else:
+                    items[key] = self.create_oval(*bbox, fill=agent['color'])
+        field = snapshot['field']
+        self.explosions.show(field['explosions'])
+        self.center_victory_text()
+        self.itemconfig(self.victory_text_id, text=field['victory_text'])
+        self.master.show_score(field['score'])
+
     def get_bullet_number(self):
         self.bullet_counter += 1
         return self.bullet_counter
 
+    def report_shot(self, bullet, power, angle):
+        self.master.report_shot(bullet, power, angle)
+
     def report_hit(self, bullet, target):
         self.last_hit_bullet_number = bullet.bullet_number
         self.master.report_hit(bullet, target)
@@ -534,11 +1032,14 @@ class BattleField(tk.Canvas):
         state = {'gun': self.gun.get_state(),
                  'targets': [t.get_state() for t in self.targets.values()],
                  'bullets': [b.get_state() for b in self.bullets.values()],
+                 'explosions': self.explosions.get_state(),
                  'bullet_counter': self.bullet_counter,
                  'last_hit_bullet_number': self.last_hit_bullet_number,
+                 'tick_counter': self.tick_counter,
                  'victory_text': self.itemcget(self.victory_text_id, 'text'),
                  'catch_victory_job': self.catch_victory_job is not None,
-                 'canvas_restart_job': self.canvas_restart_job is not None}
+                 'canvas_restart_job': self.canvas_restart_job is not None,
+                 'tick_job': self.tick_job is not None}
         return state
 
     def set_state(self, state, job_init):
@@ -547,17 +1048,28 @@ class BattleField(tk.Canvas):
         self.create_targets_from_states(state['targets'], job_init)
         self.remove_bullets()
         self.create_bullets_from_states(state['bullets'], job_init)
+        self.explosions.stop()
+        if 'explosions' in state:
+            self.explosions.set_state(state['explosions'], job_init)
+        else:
+            self.explosions.clear()
         self.bullet_counter = state['bullet_counter']
         self.last_hit_bullet_number = state['last_hit_bullet_number']
+        self.tick_counter = state.get('tick_counter', 0)
         self.itemconfig(self.victory_text_id, text=state['victory_text'])
         self.catch_victory_job = job_init if state['catch_victory_job'] else None
         self.canvas_restart_job = job_init if state['canvas_restart_job'] else None
+        self.tick_job = job_init if state.get('tick_job', True) else None
 
 
 class MainFrame(tk.Frame):
-    def __init__(self, master):
+    def __init__(self, master, game_telemetry=None):
         super().__init__(master)
 
+        # Объект `telemetry.Telemetry` или `None`, если телеметрия
+        # не собирается.
+        self.telemetry = game_telemetry
+
         self.score = 0
         self.score_tmpl = 'Score: {}'
         self.score_label = tk.Label(
@@ -571,6 +1083,7 @@ class MainFrame(tk.Frame):
         self.battlefield.pack(fill=tk.BOTH, expand=1)
 
     def new_game(self):
+        self.abandon_round()
         self.score = 0
         self.score_label['text'] = self.score_tmpl.format(self.score)
         self.battlefield.restart()
@@ -584,9 +1097,31 @@ class MainFrame(tk.Frame):
     def pause(self):
         self.battlefield.pause()
 
+    def show_score(self, score):
+        if score != self.score:
+            self.score = score
+            self.score_label['text'] = self.score_tmpl.format(self.score)
+
+    def report_shot(self, bullet, power, angle):
+        if self.telemetry is not None:
+            self.telemetry.shot(self.battlefield.tick_counter, power, angle, bullet.bullet_number)
+
     def report_hit(self, bullet, target):
         self.score += 1
         self.score_label['text'] = self.score_tmpl.format(self.score)
+        if self.telemetry is not None:
+            self.telemetry.hit(self.battlefield.tick_counter, bullet.bullet_number, [target.x, target.y, target.r])
+
+    def report_round_end(self):
+        if self.telemetry is not None:
+            self.telemetry.round_end(self.battlefield.tick_counter, self.battlefield.bullet_counter, self.score)
+
+    def abandon_round(self):
+        """Сообщает телеметрии, что текущий раунд прерван новой игрой или
+        загрузкой и не должен учитываться в статистике.
+        """
+        if self.telemetry is not None:
+            self.telemetry.abandon_round(self.battlefield.tick_counter)
 
     def get_state(self):
         state = {
@@ -596,6 +1131,7 @@ class MainFrame(tk.Frame):
         return state
 
     def set_state(self, state, job_init):
+        self.abandon_round()
         self.score = state['score']
         self.score_label['text'] = self.score_tmpl.format(self.score)
         self.battlefield.set_state(state['battlefield'], job_init)
@@ -619,7 +1155,11 @@ class Menu(tk.Menu):
 
 
 class GunGameApp(tk.Tk):
-    def __init__(self):
+    def __init__(self, server_address=None):
+        """Если задан адрес сервера `server_address` (пара хост, порт),
+        приложение работает в режиме клиента: игра идет на сервере, а
+        сохранение, загрузка, новая игра и пауза недоступны.
+        """
         super().__init__()
         self.geometry('{}x{}'.format(*WINDOW_SHAPE))
         self.title('Amazing gun game!')
@@ -633,8 +1173,11 @@ class GunGameApp(tk.Tk):
         # самостоятельно подбирает разделитель в соответствии с операционной
         # системой: '/' для UNIX и '\' для Windows.
         self.save_dir = os.path.join(os.path.split(__file__)[0], 'save')
+        self.telemetry_dir = os.path.join(os.path.split(__file__)[0], 'telemetry')
+        self.telemetry = telemetry.Telemetry(
+            os.path.join(self.telemetry_dir, time.strftime('%Y%m%d-%H%M%S') + '.jsonl'))
 
-        self.main_frame = MainFrame(self.master)
+        self.main_frame = MainFrame(self.master, self.telemetry)
         self.main_frame.pack(fill=tk.BOTH, expand=1)
 
         self.menu = Menu(self.master, self)
@@ -646,6 +1189,23 @@ class GunGameApp(tk.Tk):
         self.bind('<Control-q>', self.exit)
         self.bind('p', self.toggle_pause)
         self.on_pause = False
+        # Закрытие окна обрабатывается так же, как команда Exit, чтобы
+        # телеметрия успела записаться.
+        self.protocol('WM_DELETE_WINDOW', self.exit)
+
+        self.client = None
+        if server_address is not None:
+            self.client = netcode.ClientThread(*server_address)
+            try:
+                self.client.start()
+            except OSError as error:
+                messagebox.showerror(
+                    'Connection failed',
+                    'Could not connect to {}:{}: {}'.format(*server_address, error))
+                self.telemetry.close()
+                self.destroy()
+                raise SystemExit(1)
+            self.main_frame.battlefield.connect(self.client)
 
     def get_state(self):
         """Собирает все меняющиеся признаки виджетов и подвижных элементов
@@ -701,6 +1261,8 @@ class GunGameApp(tk.Tk):
         return file_name
 
     def save(self, event=None):
+        if self.client is not None:
+            return
         self.pause()
         game_state = self.get_state()
         file_name = self.get_save_file_name()
@@ -719,9 +1281,14 @@ class GunGameApp(tk.Tk):
             return
         if result:
             self.save()
+        self.telemetry.close()
+        if self.client is not None:
+            self.client.stop()
         self.destroy()
 
     def load(self, event=None):
+        if self.client is not None:
+            return
         self.pause()
         file_name = self.get_load_file_name()
         game_state = json.load(open(file_name))
@@ -729,13 +1296,23 @@ class GunGameApp(tk.Tk):
         self.play()
 
     def new_game(self, event=None):
+        if self.client is not None:
+            return
         self.main_frame.stop()
         self.main_frame.new_game()
 
     def toggle_pause(self, event=None):
-        if self.main_frame.battlefield.gun.job == 'pause':
+        if self.client is not None:
+            return
+        # Телеметрия записывает только паузы, поставленные игроком, а не
+        # паузы на время диалогов сохранения и загрузки.
+        job = self.main_frame.battlefield.gun.job
+        if job == 'pause':
+            self.telemetry.play()
             self.play()
         else:
+            if job is not None:
+                self.telemetry.pause()
             self.pause()
 
     def pause(self):
@@ -755,6 +1332,16 @@ class GunGameApp(tk.Tk):
         self.main_frame.stop()
 
 
-APP = GunGameApp()
-APP.new_game()
-APP.mainloop()
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Amazing gun game!')
+    PARSER.add_argument(
+        '--connect', metavar='HOST:PORT',
+        help='play on a game server started with server.py')
+    ARGS = PARSER.parse_args()
+    if ARGS.connect is None:
+        APP = GunGameApp()
+        APP.new_game()
+    else:
+        HOST, PORT = ARGS.connect.rsplit(':', 1)
+        APP = GunGameApp((HOST, int(PORT)))
+    APP.mainloop()
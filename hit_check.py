@@ -45,13 +45,15 @@ def is_hit(ball, r_ball, v, target, r_target):
 
     The ball radius-vector changes by the vector `v` and
     the function returns `True` if the target is on the way of
-    the ball.
+    the ball. If the target moves, `v` is the ball velocity
+    relative to the target.
 
     Args:
         ball (`tuple` or `list` of 2 numbers): The ball
             coordinates before the ball movement.
         r_ball (number): The ball radius.
-        v (`tuple` or `list` of 2 numbers): The ball velocity.
+        v (`tuple` or `list` of 2 numbers): The ball velocity
+            relative to the target.
         target (`tuple` or `list` of 2 numbers): The target
             coordinates.
         r_target (number): The target radius.
@@ -62,6 +64,9 @@ def is_hit(ball, r_ball, v, target, r_target):
     dr = (target[0] - ball[0], target[1] - ball[1])
     dr_norm = norm_2d(dr)
 
+    if v_norm == 0:
+        return dr_norm <= r_ball + r_target
+
     p = project(dr, v)
     p_norm = norm_2d(p)
 
@@ -0,0 +1,230 @@
+"""State replication between the game server and its clients.
+
+The server describes the game with snapshots: plain dictionaries with the
+`'field'` and `'gun'` sections and the `'targets'` and `'bullets'` sections
+keyed by agent key. Each tick a client receives only the fields that
+changed since the last snapshot it acknowledged.
+
+Messages are JSON objects, one per line.
+"""
+import asyncio
+import copy
+import json
+import threading
+from collections import OrderedDict
+
+FLAT_SECTIONS = ('field', 'gun')
+KEYED_SECTIONS = ('targets', 'bullets')
+# The number of snapshots the server and clients keep to resolve deltas.
+HISTORY_SIZE = 64
+
+
+def empty_snapshot():
+    return {section: {} for section in FLAT_SECTIONS + KEYED_SECTIONS}
+
+
+def make_snapshot(field, score):
+    """Return the snapshot of the battlefield `field`.
+
+    Args:
+        field (`gun.BattleField`): The battlefield.
+        score (int): The player score.
+    Returns:
+        dict
+    """
+    return {
+        'field': {
+            'score': score,
+            'bullet_counter': field.bullet_counter,
+            'victory_text': field.itemcget(field.victory_text_id, 'text'),
+            'explosions': field.explosions.get_state()['effects'],
+        },
+        'gun': copy.deepcopy(field.gun.get_state()),
+        'targets': {str(key): t.get_state() for key, t in field.targets.items()},
+        'bullets': {str(key): b.get_state() for key, b in field.bullets.items()},
+    }
+
+
+def diff(base, snapshot):
+    """Return the changes that turn `base` into `snapshot`.
+
+    Args:
+        base (dict or None): The snapshot the receiver has. If `None`,
+            the delta contains the whole `snapshot`.
+        snapshot (dict): The new snapshot.
+    Returns:
+        dict: the delta for `apply_delta()`.
+    """
+    if base is None:
+        base = empty_snapshot()
+    delta = {}
+    for section in FLAT_SECTIONS:
+        old = base[section]
+        changes = {k: v for k, v in snapshot[section].items() if k not in old or old[k] != v}
+        if changes:
+            delta[section] = changes
+    for section in KEYED_SECTIONS:
+        old = base[section]
+        changes = {}
+        for key, agent in snapshot[section].items():
+            before = old.get(key)
+            if before is None:
+                changes[key] = agent
+                continue
+            fields = {k: v for k, v in agent.items() if k not in before or before[k] != v}
+            if fields:
+                changes[key] = fields
+        removed = [key for key in old if key not in snapshot[section]]
+        if changes or removed:
+            delta[section] = {'changed': changes, 'removed': removed}
+    return delta
+
+
+def apply_delta(base, delta):
+    """Return the snapshot obtained by applying `delta` to `base`.
+
+    `base` is not modified.
+    """
+    if base is None:
+        base = empty_snapshot()
+    snapshot = {}
+    for section in FLAT_SECTIONS:
+        snapshot[section] = dict(base[section])
+        snapshot[section].update(delta.get(section, {}))
+    for section in KEYED_SECTIONS:
+        agents = dict(base[section])
+        changes = delta.get(section)
+        if changes is not None:
+            for key in changes['removed']:
+                agents.pop(key, None)
+            for key, fields in changes['changed'].items():
+                agents[key] = dict(agents.get(key, {}), **fields)
+        snapshot[section] = agents
+    return snapshot
+
+
+def encode(message):
+    return (json.dumps(message, separators=(',', ':')) + '\n').encode()
+
+
+def decode(line):
+    return json.loads(line)
+
+
+class GameClient:
+    """Connects to `server.GameServer` and keeps the latest snapshot.
+
+    Args:
+        host (str): The server host.
+        port (int): The server port.
+        role (str): `'player'` to control the gun or `'spectator'`.
+    """
+    def __init__(self, host='127.0.0.1', port=5555, role='player'):
+        self.host = host
+        self.port = port
+        self.role = role
+        self.reader = None
+        self.writer = None
+        self.snapshots = OrderedDict()
+        self.tick = None
+        self.snapshot = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        await self.send({'type': 'hello', 'role': self.role})
+
+    async def send(self, message):
+        self.writer.write(encode(message))
+        await self.writer.drain()
+
+    async def send_input(self, action, **fields):
+        await self.send(dict(fields, type='input', action=action))
+
+    async def receive(self):
+        """Receive one state message, update the snapshot and acknowledge
+        it.
+
+        Returns:
+            dict or None: the new snapshot, or `None` if the server closed
+            the connection.
+        """
+        line = await self.reader.readline()
+        if not line:
+            return None
+        message = decode(line)
+        base = None
+        if message['base'] is not None:
+            base = self.snapshots[message['base']]
+        snapshot = apply_delta(base, message['delta'])
+        self.snapshots[message['tick']] = snapshot
+        while len(self.snapshots) > HISTORY_SIZE:
+            self.snapshots.popitem(last=False)
+        self.tick = message['tick']
+        self.snapshot = snapshot
+        await self.send({'type': 'ack', 'tick': message['tick']})
+        return snapshot
+
+    async def run(self):
+        while await self.receive() is not None:
+            pass
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+
+class ClientThread:
+    """Runs `GameClient` in a background thread for the Tk client.
+
+    The Tk main loop reads `self.snapshot` and sends inputs with
+    `self.send_input()`; neither blocks. `self.closed` becomes true when
+    the connection ends.
+    """
+    def __init__(self, host='127.0.0.1', port=5555, role='player'):
+        self.client = GameClient(host, port, role)
+        self.loop = asyncio.new_event_loop()
+        self.connected = threading.Event()
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='game-client', daemon=True)
+
+    @property
+    def snapshot(self):
+        return self.client.snapshot
+
+    def start(self):
+        """Start the thread and wait until the client is connected.
+
+        Raises:
+            OSError: The connection failed.
+        """
+        self.thread.start()
+        self.connected.wait()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.client.connect())
+        except OSError as error:
+            self.error = error
+            self.closed = True
+            return
+        finally:
+            self.connected.set()
+        try:
+            self.loop.run_until_complete(self.client.run())
+        except OSError as error:
+            self.error = error
+        finally:
+            self.closed = True
+
+    def send_input(self, action, **fields):
+        if self.client.writer is not None and self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.client.send_input(action, **fields), self.loop)
+
+    def stop(self):
+        if self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.client.close(), self.loop)
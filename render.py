@@ -0,0 +1,476 @@
+"""Offscreen rendering of saved game states to GIF or PNG frames.
+
+The renderer draws `BattleField.get_state()` dictionaries into
+palette-indexed buffers without a Tk window, so it works on machines
+without a display. Frames are rendered on the calling thread and
+compressed on a process pool.
+
+Replays are written by `server.py --record` and `stress.py --headless
+--record`.
+
+GIF frames are compressed in pure Python, and only the region that
+changed since the previous frame is encoded. With targets spread across
+the arena one core encodes about 15 frames per second at `scale=0.5`, so
+exporting faster than the game plays (one frame per `gun.DT`) needs at
+least `GIF_MIN_WORKERS` cores; the command line warns about fewer. PNG
+frames are compressed by `zlib` and are much cheaper.
+
+Usage:
+    python stress.py --headless --duration 20 --record replay.jsonl
+    python render.py replay.jsonl replay.gif
+    python render.py save/game.json frames --format png
+"""
+import argparse
+import json
+import math
+import os
+import struct
+import sys
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import gun
+
+PALETTE = {
+    'white': (255, 255, 255),
+    'black': (0, 0, 0),
+    'orange': (255, 165, 0),
+    'yellow': (255, 255, 0),
+    'blue': (0, 0, 255),
+    'green': (0, 128, 0),
+    'red': (255, 0, 0),
+    'brown': (165, 42, 42),
+}
+COLOR_INDEX = {name: i for i, name in enumerate(PALETTE)}
+# The number of encoding processes GIF export needs to keep up with the
+# game, see the module docstring.
+GIF_MIN_WORKERS = 3
+PALETTE_BYTES = b''.join(bytes(rgb) for rgb in PALETTE.values())
+
+# 3x5 bitmap font. Text is drawn in upper case, unknown characters are
+# drawn as spaces.
+FONT = {
+    'A': '010 101 111 101 101', 'B': '110 101 110 101 110',
+    'C': '011 100 100 100 011', 'D': '110 101 101 101 110',
+    'E': '111 100 110 100 111', 'F': '111 100 110 100 100',
+    'G': '011 100 101 101 011', 'H': '101 101 111 101 101',
+    'I': '111 010 010 010 111', 'J': '001 001 001 101 010',
+    'K': '101 101 110 101 101', 'L': '100 100 100 100 111',
+    'M': '101 111 111 101 101', 'N': '110 101 101 101 101',
+    'O': '010 101 101 101 010', 'P': '110 101 110 100 100',
+    'Q': '010 101 101 110 011', 'R': '110 101 110 101 101',
+    'S': '011 100 010 001 110', 'T': '111 010 010 010 010',
+    'U': '101 101 101 101 111', 'V': '101 101 101 101 010',
+    'W': '101 101 111 111 101', 'X': '101 101 010 101 101',
+    'Y': '101 101 010 010 010', 'Z': '111 001 010 100 111',
+    '0': '111 101 101 101 111', '1': '010 110 010 010 111',
+    '2': '110 001 010 100 111', '3': '110 001 010 001 110',
+    '4': '101 101 111 001 001', '5': '111 100 110 001 110',
+    '6': '011 100 111 101 111', '7': '111 001 010 010 010',
+    '8': '111 101 111 101 111', '9': '111 101 111 001 110',
+    '!': '010 010 010 000 010', '.': '000 000 000 000 010',
+}
+
+
+class FrameRenderer:
+    """Draws battlefield states into palette-indexed frames.
+
+    Args:
+        scale (number): Frame pixels per arena unit. The frame covers
+            the whole arena.
+    """
+    def __init__(self, scale=0.5):
+        self.scale = scale
+        self.width = max(int(gun.ARENA_SHAPE[0] * scale), 1)
+        self.height = max(int(gun.ARENA_SHAPE[1] * scale), 1)
+        self.blank = bytes(self.width * self.height)
+
+    def render(self, state):
+        """Return the frame for the battlefield state `state`.
+
+        Args:
+            state (dict): A `BattleField.get_state()` dictionary.
+        Returns:
+            `bytearray` of `width * height` palette indices.
+        """
+        frame = bytearray(self.blank)
+        s = self.scale
+        for t in state['targets']:
+            self.fill_circle(frame, t['x'] * s, t['y'] * s, t['r'] * s, t['color'])
+        for b in state['bullets']:
+            self.fill_circle(frame, b['x'] * s, b['y'] * s, gun.BALL_RADIUS * s, b['color'])
+        for x, y, level in state.get('explosions', {'effects': []})['effects']:
+            # `level` is the number of the next frame of the explosion.
+            self.fill_circle(frame, x * s, y * s, 4.6 * max(level - 1, 0) * s, 'yellow')
+        g = state['gun']
+        x1, y1 = gun.get_gunpoint(g['gun_coords'], g['an'], g['f2_power'])
+        self.draw_line(
+            frame,
+            g['gun_coords'][0] * s, g['gun_coords'][1] * s,
+            x1 * s, y1 * s,
+            7 * s,
+            'orange' if g['f2_on'] else 'black'
+        )
+        if state['victory_text']:
+            self.draw_text(frame, state['victory_text'], self.width / 2, self.height / 2)
+        return frame
+
+    def fill_circle(self, frame, cx, cy, r, color):
+        if r <= 0:
+            return
+        value = COLOR_INDEX.get(color, COLOR_INDEX['black'])
+        for y in range(max(int(cy - r), 0), min(int(cy + r) + 1, self.height)):
+            half = r ** 2 - (y + 0.5 - cy) ** 2
+            if half < 0:
+                continue
+            half = half ** 0.5
+            x0 = max(int(cx - half + 0.5), 0)
+            x1 = min(int(cx + half + 0.5), self.width)
+            if x1 > x0:
+                start = y * self.width
+                frame[start + x0:start + x1] = bytes((value,)) * (x1 - x0)
+
+    def draw_line(self, frame, x0, y0, x1, y1, width, color):
+        steps = max(int(math.hypot(x1 - x0, y1 - y0)), 1)
+        for i in range(steps + 1):
+            k = i / steps
+            self.fill_circle(frame, x0 + (x1 - x0) * k, y0 + (y1 - y0) * k, width / 2, color)
+
+    def fill_rect(self, frame, x0, y0, x1, y1, value):
+        x0, x1 = max(x0, 0), min(x1, self.width)
+        if x1 <= x0:
+            return
+        for y in range(max(y0, 0), min(y1, self.height)):
+            start = y * self.width
+            frame[start + x0:start + x1] = bytes((value,)) * (x1 - x0)
+
+    def draw_text(self, frame, text, cx, cy, color='black'):
+        value = COLOR_INDEX[color]
+        pixel = max(int(8 * self.scale), 1)
+        text = text.upper()
+        x = int(cx - len(text) * 4 * pixel / 2)
+        y = int(cy - 5 * pixel / 2)
+        for char in text:
+            rows = FONT.get(char, '000 000 000 000 000').split()
+            for i, row in enumerate(rows):
+                for j, bit in enumerate(row):
+                    if bit == '1':
+                        self.fill_rect(
+                            frame,
+                            x + j * pixel, y + i * pixel,
+                            x + (j + 1) * pixel, y + (i + 1) * pixel,
+                            value
+                        )
+            x += 4 * pixel
+
+
+def png_chunk(kind, data):
+    chunk = kind + data
+    return struct.pack('>I', len(data)) + chunk + struct.pack('>I', zlib.crc32(chunk))
+
+
+def encode_png(frame, width, height):
+    """Return a palette PNG image of the frame.
+
+    Args:
+        frame (`bytes`): `width * height` palette indices.
+        width (int): The frame width.
+        height (int): The frame height.
+    Returns:
+        bytes
+    """
+    raw = bytearray()
+    for y in range(height):
+        # Filter type 0: the row is stored as is.
+        raw.append(0)
+        raw += frame[y * width:(y + 1) * width]
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0))
+        + png_chunk(b'PLTE', PALETTE_BYTES)
+        + png_chunk(b'IDAT', zlib.compress(bytes(raw), 6))
+        + png_chunk(b'IEND', b'')
+    )
+
+
+def lzw_encode(indices, min_code_size):
+    """Return GIF LZW codes of `indices` packed into bytes.
+
+    Args:
+        indices (`bytes`): Palette indices, each less than
+            `2 ** min_code_size`.
+        min_code_size (int): The LZW minimum code size.
+    Returns:
+        bytearray
+    """
+    clear_code = 1 << min_code_size
+    end_code = clear_code + 1
+    out = bytearray()
+    bits = 0
+    n_bits = 0
+    code_size = min_code_size + 1
+    next_code = end_code + 1
+    table = {}
+
+    def emit(code, bits, n_bits):
+        bits |= code << n_bits
+        n_bits += code_size
+        while n_bits >= 8:
+            out.append(bits & 0xff)
+            bits >>= 8
+            n_bits -= 8
+        return bits, n_bits
+
+    bits, n_bits = emit(clear_code, bits, n_bits)
+    prefix = indices[0]
+    for k in indices[1:]:
+        key = (prefix << 8) | k
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        bits, n_bits = emit(prefix, bits, n_bits)
+        if next_code >= (1 << code_size) and code_size < 12:
+            code_size += 1
+        if next_code < 4096:
+            table[key] = next_code
+            next_code += 1
+        else:
+            bits, n_bits = emit(clear_code, bits, n_bits)
+            table = {}
+            next_code = end_code + 1
+            code_size = min_code_size + 1
+        prefix = k
+    bits, n_bits = emit(prefix, bits, n_bits)
+    if next_code >= (1 << code_size) and code_size < 12:
+        code_size += 1
+    bits, n_bits = emit(end_code, bits, n_bits)
+    if n_bits:
+        out.append(bits & 0xff)
+    return out
+
+
+def common_prefix_length(a, b):
+    """Return the length of the common prefix of `a` and `b`.
+
+    Slices are compared in C, so a binary search is much faster than a
+    Python loop over bytes.
+    """
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def get_changed_region(frame, previous, width, height):
+    """Return the bounding box of the pixels that differ between frames.
+
+    Args:
+        frame (`bytes`): The new frame.
+        previous (`bytes` or None): The previous frame. If `None`, the
+            whole frame is returned.
+        width (int): The frame width.
+        height (int): The frame height.
+    Returns:
+        `tuple` `(left, top, width, height)`. If the frames are equal,
+        a 1x1 region in the top left corner is returned, since a GIF
+        frame can not be empty.
+    """
+    if previous is None:
+        return 0, 0, width, height
+    left, right = width, 0
+    top, bottom = None, 0
+    for y in range(height):
+        row = frame[y * width:(y + 1) * width]
+        previous_row = previous[y * width:(y + 1) * width]
+        if row == previous_row:
+            continue
+        if top is None:
+            top = y
+        bottom = y + 1
+        left = min(left, common_prefix_length(row, previous_row))
+        right = max(right, width - common_prefix_length(row[::-1], previous_row[::-1]))
+    if top is None:
+        return 0, 0, 1, 1
+    return left, top, right - left, bottom - top
+
+
+def crop(frame, width, region):
+    left, top, region_width, region_height = region
+    return b''.join(
+        frame[y * width + left:y * width + left + region_width]
+        for y in range(top, top + region_height)
+    )
+
+
+def encode_gif_frame(pixels, region):
+    """Return the image data block of one GIF frame.
+
+    The block consists of the image descriptor, the LZW minimum code size
+    and the LZW data split into sub-blocks.
+
+    Args:
+        pixels (`bytes`): Palette indices of the region.
+        region (`tuple`): `(left, top, width, height)` of the region in
+            the frame.
+    """
+    min_code_size = max((len(PALETTE) - 1).bit_length(), 2)
+    data = lzw_encode(pixels, min_code_size)
+    block = bytearray(b',' + struct.pack('<HHHHB', *region, 0))
+    block.append(min_code_size)
+    for i in range(0, len(data), 255):
+        sub_block = data[i:i + 255]
+        block.append(len(sub_block))
+        block += sub_block
+    block.append(0)
+    return bytes(block)
+
+
+class GifWriter:
+    """Writes frames encoded with `encode_gif_frame()` into a looped
+    animated GIF.
+
+    Only the region that changed since the previous frame is encoded, and
+    frames are not disposed, so each frame is drawn over the previous
+    one.
+    """
+    encode = staticmethod(encode_gif_frame)
+
+    def __init__(self, path, width, height, delay=gun.DT):
+        self.width = width
+        self.height = height
+        self.file = open(path, 'wb')
+        # GIF delays are measured in hundredths of a second.
+        self.delay = max(round(delay / 10), 1)
+        table_size = (len(PALETTE) - 1).bit_length()
+        color_table = PALETTE_BYTES + bytes(3 * ((1 << table_size) - len(PALETTE)))
+        self.file.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0xf0 | (table_size - 1), 0, 0))
+        self.file.write(color_table)
+        self.file.write(b'!\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00')
+
+    def prepare(self, frame, previous):
+        """Return the arguments of `self.encode()` for the frame."""
+        region = get_changed_region(frame, previous, self.width, self.height)
+        return crop(frame, self.width, region), region
+
+    def write(self, data):
+        # Disposal method 1: the frame stays under the next one.
+        self.file.write(b'!\xf9\x04\x04' + struct.pack('<H', self.delay) + b'\x00\x00')
+        self.file.write(data)
+
+    def close(self):
+        self.file.write(b';')
+        self.file.close()
+
+
+class PngSequenceWriter:
+    """Writes frames encoded with `encode_png()` into numbered files of
+    the directory `path`.
+    """
+    encode = staticmethod(encode_png)
+
+    def __init__(self, path, width, height, delay=gun.DT):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.width = width
+        self.height = height
+        self.count = 0
+
+    def prepare(self, frame, previous):
+        """Return the arguments of `self.encode()` for the frame."""
+        return frame, self.width, self.height
+
+    def write(self, data):
+        with open(os.path.join(self.path, 'frame_{:05d}.png'.format(self.count)), 'wb') as f:
+            f.write(data)
+        self.count += 1
+
+    def close(self):
+        pass
+
+
+WRITERS = {'gif': GifWriter, 'png': PngSequenceWriter}
+
+
+def export(states, path, fmt='gif', scale=0.5, workers=None):
+    """Render battlefield states and save them as an animation.
+
+    Frames are rendered on the calling thread and encoded on a process
+    pool. At most `2 * workers` frames are in flight, so long replays do
+    not have to fit in memory.
+
+    Args:
+        states (iterable of dict): `BattleField.get_state()` dictionaries,
+            one per frame.
+        path (str): The GIF file name or the PNG directory name.
+        fmt (str): `'gif'` or `'png'`.
+        scale (number): Frame pixels per arena unit.
+        workers (int or None): The number of encoding processes.
+    Returns:
+        int: the number of frames written.
+    """
+    renderer = FrameRenderer(scale)
+    writer = WRITERS[fmt](path, renderer.width, renderer.height)
+    workers = workers or os.cpu_count() or 1
+    count = 0
+    previous = None
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for state in states:
+            frame = bytes(renderer.render(state))
+            pending.append(pool.submit(writer.encode, *writer.prepare(frame, previous)))
+            previous = frame
+            if len(pending) >= 2 * workers:
+                writer.write(pending.popleft().result())
+                count += 1
+        while pending:
+            writer.write(pending.popleft().result())
+            count += 1
+    writer.close()
+    return count
+
+
+def load_states(file_name):
+    """Yield battlefield states from a save file or a replay.
+
+    A save file is a JSON document written by `GunGameApp.save()`. A
+    replay is a JSON Lines file with one such document per line.
+    Battlefield states are accepted as well.
+    """
+    with open(file_name) as f:
+        text = f.read()
+    try:
+        documents = [json.loads(text)]
+    except json.JSONDecodeError:
+        documents = (json.loads(line) for line in text.splitlines() if line.strip())
+    for document in documents:
+        if 'main_frame' in document:
+            document = document['main_frame']['battlefield']
+        yield document
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render saved games without a window.')
+    parser.add_argument('source', help='a save file or a JSON Lines replay')
+    parser.add_argument('output', help='a GIF file or a directory for PNG frames')
+    parser.add_argument('--format', choices=sorted(WRITERS), default='gif')
+    parser.add_argument('--scale', type=float, default=0.5)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count() or 1
+    if args.format == 'gif' and workers < GIF_MIN_WORKERS:
+        print(
+            'warning: GIF export with {} worker(s) may be slower than real time, '
+            'use --format png or at least {} workers'.format(workers, GIF_MIN_WORKERS),
+            file=sys.stderr)
+    count = export(load_states(args.source), args.output, args.format, args.scale, args.workers)
+    print('{} frames written to {}'.format(count, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+"""Local game server.
+
+The server runs the authoritative `BattleField` simulation without a Tk
+window and accepts gun inputs from player clients over TCP. Each tick
+every client receives the changes since the last state it acknowledged
+(see `netcode`).
+
+Usage:
+    python server.py --port 5555
+    python gun.py --connect 127.0.0.1:5555
+
+With `--record replay.jsonl` the server also writes the battlefield state
+of every tick to a JSON Lines replay, which `render.py` turns into a GIF.
+"""
+import argparse
+import asyncio
+import json
+import tkinter as tk
+from collections import OrderedDict
+
+import netcode
+from gun import ARENA_SHAPE, DT, WINDOW_SHAPE, BattleField
+
+# Clients whose socket buffer holds more than this many bytes skip ticks.
+# Skipping is safe: the next delta is computed against the last
+# acknowledged state.
+MAX_CLIENT_BUFFER = 1 << 20
+
+
+class HeadlessTcl:
+    """Stands in for the Tcl interpreter of `HeadlessCanvas`.
+
+    `tk.Canvas` methods that `HeadlessCanvas` does not replace send a Tcl
+    command through it and get `NotImplementedError` naming the command.
+    """
+    def call(self, *args):
+        if len(args) == 1 and isinstance(args[0], tuple):
+            args = args[0]
+        raise NotImplementedError(
+            'HeadlessCanvas does not support the Tcl command {!r}; '
+            'implement the tk.Canvas method that sends it in server.HeadlessCanvas'.format(
+                ' '.join(str(arg) for arg in args[:3])))
+
+    def __getattr__(self, name):
+        def unsupported(*args):
+            raise NotImplementedError(
+                'HeadlessCanvas does not support the Tcl interpreter method {!r}'.format(name))
+        return unsupported
+
+
+class HeadlessCanvas(tk.Canvas):
+    """Replaces the Tk canvas calls agents make, without a Tk window.
+
+    Delayed jobs run when `self.advance()` moves the canvas clock.
+    Canvas items are plain dictionaries.
+
+    The class derives from `tk.Canvas` only to sit before it in the method
+    resolution order of `HeadlessField`, and `tk.Canvas.__init__()` is
+    never called. The methods below are the whole supported canvas
+    interface: `after`, `after_cancel`, `create_oval`, `create_line`,
+    `create_text`, `coords`, `itemconfig`, `itemcget`, `delete`,
+    `find_all`, `bind`, `winfo_width`, `winfo_height`, `canvasx`,
+    `canvasy`, `xview_moveto` and `yview_moveto`. Any other `tk.Canvas`
+    method reaches `HeadlessTcl` and raises `NotImplementedError`.
+    """
+    def __init__(self, master=None, **options):
+        self.master = master
+        # `tk.Misc` reads these in `repr()`, `str()` and Tcl calls.
+        self.tk = HeadlessTcl()
+        self._w = '.headless'
+        self.time = 0
+        self.job_counter = 0
+        self.jobs = {}
+        self.item_counter = 0
+        self.items = {}
+        self.origin = [0, 0]
+
+    def after(self, ms, func):
+        self.job_counter += 1
+        job = 'after#{}'.format(self.job_counter)
+        self.jobs[job] = (self.time + ms, self.job_counter, func)
+        return job
+
+    def after_cancel(self, job):
+        self.jobs.pop(job, None)
+
+    def advance(self, ms=DT):
+        """Move the clock by `ms` milliseconds and run due jobs."""
+        self.time += ms
+        due = sorted((v[:2], job) for job, v in self.jobs.items() if v[0] <= self.time)
+        for _, job in due:
+            # A job may be cancelled by a job run before it.
+            if job in self.jobs:
+                self.jobs.pop(job)[2]()
+
+    def create_item(self, coords, options):
+        self.item_counter += 1
+        self.items[self.item_counter] = dict(options, coords=coords)
+        return self.item_counter
+
+    def create_oval(self, *coords, **options):
+        return self.create_item(coords, options)
+
+    def create_line(self, *coords, **options):
+        return self.create_item(coords, options)
+
+    def create_text(self, *coords, **options):
+        return self.create_item(coords, options)
+
+    def coords(self, item, *coords):
+        self.items[item]['coords'] = coords
+
+    def itemconfig(self, item, **options):
+        self.items[item].update(options)
+
+    def itemcget(self, item, option):
+        return self.items[item].get(option, '')
+
+    def delete(self, item):
+        self.items.pop(item, None)
+
+    def find_all(self):
+        return tuple(self.items)
+
+    def bind(self, *args, **kwargs):
+        pass
+
+    def winfo_width(self):
+        return WINDOW_SHAPE[0]
+
+    def winfo_height(self):
+        return WINDOW_SHAPE[1]
+
+    def canvasx(self, x):
+        return self.origin[0] + x
+
+    def canvasy(self, y):
+        return self.origin[1] + y
+
+    def xview_moveto(self, fraction):
+        self.origin[0] = fraction * ARENA_SHAPE[0]
+
+    def yview_moveto(self, fraction):
+        self.origin[1] = fraction * ARENA_SHAPE[1]
+
+
+class HeadlessField(BattleField, HeadlessCanvas):
+    """`BattleField` simulated on `HeadlessCanvas`.
+
+    Nothing is drawn, and the gun aims at `self.aim` instead of the mouse
+    pointer.
+    """
+    def __init__(self, master):
+        self.aim = [ARENA_SHAPE[0] / 2, ARENA_SHAPE[1] / 2]
+        super().__init__(master)
+
+    def get_root(self):
+        return self
+
+    def get_mouse_coords(self):
+        return self.aim
+
+    def is_visible(self, x0, y0, x1, y1):
+        return False
+
+
+class HeadlessGame:
+    """Plays the part of `MainFrame` for `HeadlessField`."""
+    def __init__(self):
+        self.score = 0
+        self.field = HeadlessField(self)
+
+    def new_game(self):
+        self.field.stop()
+        self.score = 0
+        self.field.restart()
+
+    def step(self):
+        self.field.advance(DT)
+
+    def report_shot(self, bullet, power, angle):
+        pass
+
+    def report_hit(self, bullet, target):
+        self.score += 1
+
+    def report_round_end(self):
+        pass
+
+    def apply_input(self, message):
+        """Apply a player input message to the gun."""
+        gun = self.field.gun
+        action = message['action']
+        if action == 'aim':
+            self.field.aim = [message['x'], message['y']]
+            gun.wake()
+        elif action == 'fire_start':
+            gun.fire2_start(None)
+        elif action == 'fire_end':
+            gun.fire2_end(None)
+        elif action == 'up':
+            gun.set_movement_direction_to_up(None)
+        elif action == 'down':
+            gun.set_movement_direction_to_down(None)
+        elif action == 'stop':
+            gun.stop_movement(None)
+
+
+class ClientState:
+    def __init__(self, writer):
+        self.writer = writer
+        self.role = 'spectator'
+        self.acked = None
+
+
+class GameServer:
+    """Runs `HeadlessGame` and broadcasts it to connected clients.
+
+    Args:
+        host (str): The interface to listen on.
+        port (int): The port. If 0, a free port is chosen and stored in
+            `self.port` by `self.start()`.
+        record (str or None): The path of a JSON Lines replay to write
+            the battlefield state of every tick to.
+    """
+    def __init__(self, host='127.0.0.1', port=5555, record=None):
+        self.host = host
+        self.port = port
+        self.record = None if record is None else open(record, 'w')
+        self.game = HeadlessGame()
+        self.clients = {}
+        self.handlers = set()
+        self.history = OrderedDict()
+        self.tick = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.game.new_game()
+
+    async def run(self, ticks=None):
+        """Simulate and broadcast in real time.
+
+        Args:
+            ticks (int or None): Stop after this number of ticks. If
+                `None`, run until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        while ticks is None or self.tick < ticks:
+            self.step()
+            next_time += DT / 1000
+            await asyncio.sleep(max(next_time - loop.time(), 0))
+
+    def step(self):
+        self.game.step()
+        self.tick += 1
+        snapshot = netcode.make_snapshot(self.game.field, self.game.score)
+        self.history[self.tick] = snapshot
+        while len(self.history) > netcode.HISTORY_SIZE:
+            self.history.popitem(last=False)
+        for client in list(self.clients.values()):
+            self.send_state(client, snapshot)
+        if self.record is not None:
+            self.record.write(json.dumps(self.game.field.get_state()) + '\n')
+
+    def send_state(self, client, snapshot):
+        transport = client.writer.transport
+        if transport.is_closing() or transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+            return
+        base = self.history.get(client.acked)
+        message = {
+            'type': 'state',
+            'tick': self.tick,
+            'base': client.acked if base is not None else None,
+            'delta': netcode.diff(base, snapshot),
+        }
+        client.writer.write(netcode.encode(message))
+
+    async def handle_client(self, reader, writer):
+        client = ClientState(writer)
+        self.clients[writer] = client
+        handler = asyncio.current_task()
+        self.handlers.add(handler)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = netcode.decode(line)
+                if message['type'] == 'hello':
+                    client.role = message['role']
+                elif message['type'] == 'ack':
+                    if client.acked is None or message['tick'] > client.acked:
+                        client.acked = message['tick']
+                elif message['type'] == 'input' and client.role == 'player':
+                    self.game.apply_input(message)
+        except ConnectionError:
+            pass
+        finally:
+            del self.clients[writer]
+            self.handlers.discard(handler)
+            writer.close()
+
+    async def close(self):
+        self.server.close()
+        # Closing a connection ends its handler with an end of file.
+        for writer in list(self.clients):
+            writer.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+        if self.record is not None:
+            self.record.close()
+
+
+async def serve(host, port, record=None):
+    server = GameServer(host, port, record)
+    await server.start()
+    print('Serving on {}:{}'.format(host, server.port))
+    try:
+        await server.run()
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the game server on localhost.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--record', help='write every tick to this JSON Lines replay')
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.record))
+
+
+if __name__ == '__main__':
+    main()
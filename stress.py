@@ -0,0 +1,243 @@
+"""Synthetic load generator and soak test.
+
+The gun fires automatically at a fixed rate with random angles and
+powers, while frame time, memory use, canvas item counts, leaked
+agents and destroyed agents left in `field.bullets` or `field.targets`
+(stale entries) are sampled over time.
+
+Usage:
+    python stress.py --duration 60 --rate 20 --targets 200
+    python stress.py --headless --duration 600 --rate 50 --report soak.json
+    python stress.py --headless --duration 20 --record replay.jsonl
+
+In the Tk mode the generator ticks every `DT` milliseconds of wall time,
+and the frame time is the lag of a tick behind that schedule: the
+interval between two ticks minus `DT`. The load is sustained if the lag
+stays within `--tolerance`. In the headless mode the simulation runs as
+fast as it can, the clock is simulated, and the frame time is the time
+one simulation step takes, which must fit into `DT`.
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import time
+import weakref
+from random import Random
+
+import gun
+import server
+
+
+def get_memory():
+    """Return the resident set size in bytes, or `None` if unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+class StressTest:
+    """Fires the gun of `field` and samples its resource use.
+
+    Args:
+        field (`gun.BattleField`): The battlefield. Its rounds are started
+            by the caller.
+        rate (number): Shots per second.
+        spread (number): The angle spread of shots in degrees around
+            45 degrees up.
+        duration (number): The test duration in seconds.
+        sample_interval (number): Seconds between samples.
+        seed (int or None): The random seed.
+        budget (number): The largest typical frame time in seconds at
+            which the load counts as sustained.
+    """
+    def __init__(self, field, rate=10, spread=60, duration=60, sample_interval=1.0, seed=None, budget=gun.DT / 1000):
+        self.field = field
+        self.rate = rate
+        self.spread = math.radians(spread)
+        self.duration = duration
+        self.sample_interval = sample_interval
+        self.random = Random(seed)
+        self.budget = budget
+
+        # Seconds on the test clock: wall time in the Tk mode, simulated
+        # time in the headless mode.
+        self.time = 0
+        self.start_time = time.perf_counter()
+        self.next_sample = 0
+        self.pending_shots = 0
+        self.shots = 0
+        self.frame_times = []
+        self.samples = []
+        self.memory_start = get_memory()
+        # Agents seen in `field.bullets` and `field.targets`. An agent that
+        # is still alive after it left the dictionaries is leaked.
+        self.agents = weakref.WeakSet()
+
+    @property
+    def finished(self):
+        return self.time >= self.duration
+
+    def tick(self, frame_time, interval=gun.DT / 1000):
+        """Record the frame time, advance the clock by `interval` and fire
+        due shots. Both arguments are in seconds.
+        """
+        self.time += interval
+        self.frame_times.append(frame_time)
+        self.pending_shots += self.rate * interval
+        while self.pending_shots >= 1:
+            self.pending_shots -= 1
+            self.fire()
+        if self.time >= self.next_sample:
+            self.sample()
+            self.next_sample += self.sample_interval
+
+    def fire(self):
+        g = self.field.gun
+        g.an = -math.pi / 4 + self.random.uniform(-self.spread / 2, self.spread / 2)
+        g.f2_power = self.random.uniform(g.min_gun_power, g.max_gun_power)
+        g.fire2_end(None)
+        self.shots += 1
+
+    def count_expected_items(self):
+        field = self.field
+        agents = list(field.bullets.values()) + list(field.targets.values())
+        count = sum(agent.id is not None for agent in agents)
+        count += field.gun.id is not None
+        count += sum(effect[3] is not None for effect in field.explosions.effects)
+        count += len(field.explosions.free_ids)
+        count += sum(len(items) for items in field.remote_items.values())
+        # The victory text.
+        return count + 1
+
+    def sample(self):
+        field = self.field
+        self.agents.update(field.bullets.values())
+        self.agents.update(field.targets.values())
+        gc.collect()
+        live = set(field.bullets.values()) | set(field.targets.values())
+        leaked_agents = sum(agent not in live for agent in self.agents)
+        # Destroyed agents whose `destroy()` did not remove them.
+        stale_entries = sum(agent.destroyed for agent in live)
+        items = len(field.find_all())
+        frames = self.frame_times
+        self.frame_times = []
+        memory = get_memory()
+        self.samples.append({
+            'time': round(self.time, 3),
+            'shots': self.shots,
+            'bullets': len(field.bullets),
+            'targets': len(field.targets),
+            'explosions': len(field.explosions.effects),
+            'canvas_items': items,
+            'leaked_items': max(items - self.count_expected_items(), 0),
+            'leaked_agents': leaked_agents,
+            'stale_entries': stale_entries,
+            'memory': memory,
+            'frame_time_mean': sum(frames) / len(frames) if frames else None,
+            'frame_time_p95': percentile(frames, 0.95),
+            'frame_time_max': max(frames) if frames else None,
+        })
+
+    def report(self):
+        """Return the samples and a summary of the run."""
+        p95 = [s['frame_time_p95'] for s in self.samples if s['frame_time_p95'] is not None]
+        last = self.samples[-1] if self.samples else {}
+        memory_end = last.get('memory')
+        summary = {
+            'duration': self.time,
+            'wall_time': time.perf_counter() - self.start_time,
+            'shots': self.shots,
+            'shots_per_second': self.shots / self.time if self.time else 0,
+            'frame_time_p95': percentile(p95, 0.5),
+            'frame_time_max': max((s['frame_time_max'] for s in self.samples if s['frame_time_max']), default=None),
+            # The load is sustained if a typical frame fits into the budget.
+            'sustained': bool(p95) and percentile(p95, 0.5) <= self.budget,
+            'memory_growth': None if None in (self.memory_start, memory_end) else memory_end - self.memory_start,
+            'leaked_items': last.get('leaked_items'),
+            'leaked_agents': last.get('leaked_agents'),
+            'stale_entries': last.get('stale_entries'),
+        }
+        return {'summary': summary, 'samples': self.samples}
+
+
+def run_tk(args):
+    app = gun.GunGameApp()
+    field = app.main_frame.battlefield
+    field.num_targets = args.targets
+    app.new_game()
+    test = StressTest(field, args.rate, args.spread, args.duration, seed=args.seed, budget=args.tolerance / 1000)
+    last = [time.perf_counter()]
+
+    def tick():
+        now = time.perf_counter()
+        interval = now - last[0]
+        test.tick(max(interval - gun.DT / 1000, 0), interval)
+        # Sampling collects garbage; its time is not the game's lag, so the
+        # next interval is measured from here.
+        last[0] = time.perf_counter()
+        if test.finished:
+            app.quit()
+        else:
+            field.after(gun.DT, tick)
+
+    field.after(gun.DT, tick)
+    app.mainloop()
+    app.telemetry.close()
+    return test.report()
+
+
+def run_headless(args):
+    game = server.HeadlessGame()
+    game.field.num_targets = args.targets
+    game.new_game()
+    test = StressTest(game.field, args.rate, args.spread, args.duration, seed=args.seed)
+    record = None if args.record is None else open(args.record, 'w')
+    frame_time = 0
+    while not test.finished:
+        start = time.perf_counter()
+        test.tick(frame_time)
+        game.step()
+        frame_time = time.perf_counter() - start
+        if record is not None:
+            record.write(json.dumps(game.field.get_state()) + '\n')
+    if record is not None:
+        record.close()
+    return test.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fire the gun automatically and measure the game.')
+    parser.add_argument('--duration', type=float, default=60, help='seconds')
+    parser.add_argument('--rate', type=float, default=10, help='shots per second')
+    parser.add_argument('--spread', type=float, default=60, help='angle spread in degrees')
+    parser.add_argument('--targets', type=int, default=4, help='targets per round')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument(
+        '--tolerance', type=float, default=5,
+        help='largest typical lag behind the tick schedule in ms (Tk mode)')
+    parser.add_argument('--headless', action='store_true', help='simulate without a window')
+    parser.add_argument('--report', help='write samples and the summary to this JSON file')
+    parser.add_argument('--record', help='write every tick to this JSON Lines replay (headless only)')
+    args = parser.parse_args()
+    if args.record and not args.headless:
+        parser.error('--record requires --headless')
+    report = run_headless(args) if args.headless else run_tk(args)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report['summary'], indent=2))
+
+
+if __name__ == '__main__':
+    main()
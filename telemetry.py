@@ -0,0 +1,195 @@
+"""Buffered gameplay telemetry.
+
+Events are appended to an in-memory ring buffer and written to a JSON
+Lines file by a background thread, so the game loop never waits for the
+disk. Rolling aggregates are updated as events arrive and can be queried
+in-process.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+
+class Telemetry:
+    """Collects game events and rolling statistics.
+
+    Args:
+        path (str or None): The JSON Lines file events are appended to.
+            If `None`, events are only aggregated.
+        capacity (int): The ring buffer size. If the writer falls behind,
+            the oldest unwritten events are dropped and counted in
+            `self.dropped`. Events lost to a failed write are counted
+            there as well.
+        flush_interval (number): Seconds between background flushes.
+        power_bucket (int): The width of shot power buckets.
+        window (int): The number of last rounds the aggregates cover.
+    """
+    def __init__(self, path=None, capacity=4096, flush_interval=1.0, power_bucket=10, window=20):
+        self.path = path
+        self.buffer = deque(maxlen=capacity)
+        self.dropped = 0
+        self.flush_interval = flush_interval
+        self.power_bucket = power_bucket
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.closed = False
+
+        self.rounds = deque(maxlen=window)
+        self.round = self.new_round()
+
+        self.thread = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.thread = threading.Thread(target=self.run, name='telemetry-writer', daemon=True)
+            self.thread.start()
+
+    @staticmethod
+    def new_round():
+        return {
+            'shots': 0,
+            'hits': 0,
+            # Bullet number -> power bucket.
+            'bullets': {},
+            'hit_bullets': set(),
+            'power_shots': Counter(),
+            'power_hits': Counter(),
+        }
+
+    def emit(self, event, **fields):
+        """Record the event `event` with the fields `fields`.
+
+        Does nothing after `self.close()`.
+        """
+        record = {'event': event, 'time': time.time()}
+        record.update(fields)
+        with self.lock:
+            if self.closed:
+                return
+            self.aggregate(record)
+            if self.path is None:
+                return
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(record)
+            full = len(self.buffer) * 2 >= self.buffer.maxlen
+        if full:
+            self.wake.set()
+
+    def shot(self, tick, power, angle, bullet_number):
+        self.emit('shot', tick=tick, power=power, angle=angle, bullet_number=bullet_number)
+
+    def hit(self, tick, bullet_number, target):
+        self.emit('hit', tick=tick, bullet_number=bullet_number, target=target)
+
+    def round_end(self, tick, shots, score):
+        self.emit('round_end', tick=tick, shots=shots, score=score)
+
+    def abandon_round(self, tick):
+        """Close the current round without counting it.
+
+        Called when a new game is started or a game is loaded before the
+        round is won. Nothing is recorded if no shot was fired in the
+        round.
+        """
+        with self.lock:
+            if not self.round['shots']:
+                return
+        self.emit('round_end', tick=tick, abandoned=True)
+
+    def pause(self):
+        self.emit('pause')
+
+    def play(self):
+        self.emit('play')
+
+    def aggregate(self, record):
+        current = self.round
+        if record['event'] == 'shot':
+            bucket = self.get_power_bucket(record['power'])
+            current['shots'] += 1
+            current['bullets'][record['bullet_number']] = bucket
+            current['power_shots'][bucket] += 1
+        elif record['event'] == 'hit':
+            current['hits'] += 1
+            number = record['bullet_number']
+            # Hit rate is counted per bullet: a bullet that hits several
+            # targets is counted once.
+            if number in current['bullets'] and number not in current['hit_bullets']:
+                current['hit_bullets'].add(number)
+                current['power_hits'][current['bullets'][number]] += 1
+        elif record['event'] == 'round_end':
+            if not record.get('abandoned'):
+                self.rounds.append(current)
+            self.round = self.new_round()
+
+    def get_power_bucket(self, power):
+        """Return the lower bound of the power bucket `power` falls into."""
+        return int(power // self.power_bucket * self.power_bucket)
+
+    def shots_per_round(self):
+        """Return shot counts of the finished rounds in the window."""
+        with self.lock:
+            return [r['shots'] for r in self.rounds]
+
+    def hit_rate_by_power(self):
+        """Return the share of shots that hit at least one target.
+
+        Finished rounds in the window and the current round are counted.
+
+        Returns:
+            `dict`: power bucket lower bound -> hit rate.
+        """
+        with self.lock:
+            shots = Counter()
+            hits = Counter()
+            for r in list(self.rounds) + [self.round]:
+                shots.update(r['power_shots'])
+                hits.update(r['power_hits'])
+        return {bucket: hits[bucket] / shots[bucket] for bucket in sorted(shots)}
+
+    def run(self):
+        while not self.closed:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush_or_report()
+
+    def flush(self):
+        """Write buffered events to the file.
+
+        Raises:
+            OSError: The write failed. The events are lost and counted in
+                `self.dropped`.
+        """
+        with self.lock:
+            events = list(self.buffer)
+            self.buffer.clear()
+        if not events or self.path is None:
+            return
+        try:
+            with open(self.path, 'a') as f:
+                f.write(''.join(json.dumps(event) + '\n' for event in events))
+        except OSError:
+            with self.lock:
+                self.dropped += len(events)
+            raise
+
+    def flush_or_report(self):
+        """Write buffered events, printing a failure to stderr instead of
+        raising it, so that one failed write does not stop the writer.
+        """
+        try:
+            self.flush()
+        except OSError as error:
+            print('telemetry: could not write {}: {}'.format(self.path, error), file=sys.stderr)
+
+    def close(self):
+        """Stop the background writer and write the remaining events."""
+        with self.lock:
+            self.closed = True
+        if self.thread is not None:
+            self.wake.set()
+            self.thread.join()
+        self.flush_or_report()
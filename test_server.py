@@ -0,0 +1,119 @@
+"""Loopback tests of `server.GameServer` and `netcode.GameClient`.
+
+The server is stepped by hand, so the tests do not depend on timing.
+"""
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+import netcode
+import server
+
+TIMEOUT = 5
+
+
+def normalise(snapshot):
+    """Return `snapshot` as it looks after a round trip through JSON."""
+    return json.loads(json.dumps(snapshot))
+
+
+class LoopbackTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = server.GameServer(port=0)
+        await self.server.start()
+        self.player = netcode.GameClient(port=self.server.port, role='player')
+        self.spectator = netcode.GameClient(port=self.server.port, role='spectator')
+        await self.player.connect()
+        await self.spectator.connect()
+        await self.wait_for(lambda: sorted(c.role for c in self.server.clients.values()) == ['player', 'spectator'])
+
+    async def asyncTearDown(self):
+        await self.player.close()
+        await self.spectator.close()
+        await self.server.close()
+
+    async def wait_for(self, condition):
+        async def poll():
+            while not condition():
+                await asyncio.sleep(0.001)
+        await asyncio.wait_for(poll(), TIMEOUT)
+
+    def get_state(self, client):
+        return next(c for c in self.server.clients.values() if c.role == client.role)
+
+    async def receive(self, client):
+        """Receive one state and wait until the server has its ack."""
+        snapshot = await asyncio.wait_for(client.receive(), TIMEOUT)
+        self.assertIsNotNone(snapshot)
+        state = self.get_state(client)
+        await self.wait_for(lambda: state.acked == client.tick)
+        return snapshot
+
+    async def step(self, ticks=1):
+        for _ in range(ticks):
+            self.server.step()
+            for client in (self.player, self.spectator):
+                await self.receive(client)
+                self.assert_in_sync(client)
+
+    def assert_in_sync(self, client):
+        self.assertEqual(client.snapshot, normalise(self.server.history[client.tick]))
+
+    async def test_clients_follow_server(self):
+        await self.step(10)
+        await self.player.send_input('aim', x=1500, y=700)
+        await self.player.send_input('fire_start')
+        await self.step(5)
+        await self.player.send_input('fire_end')
+        await self.wait_for(lambda: self.server.game.field.bullets)
+        await self.step(30)
+        self.assertEqual(self.player.tick, self.server.tick)
+        self.assertEqual(self.spectator.snapshot, self.player.snapshot)
+
+    async def test_spectator_input_is_ignored(self):
+        await self.step()
+        gun_coords = list(self.server.game.field.gun.gun_coords)
+        await self.spectator.send_input('down')
+        # The player's message is handled after the spectator's one.
+        await self.player.send_input('aim', x=0, y=0)
+        await self.wait_for(lambda: self.server.game.field.aim == [0, 0])
+        await self.step(10)
+        self.assertEqual(self.server.game.field.gun.gun_coords, gun_coords)
+
+    async def test_skipped_ticks(self):
+        await self.step(5)
+        acked = self.get_state(self.spectator).acked
+        # A full socket buffer makes the server skip the spectator.
+        with mock.patch.object(server, 'MAX_CLIENT_BUFFER', -1):
+            for _ in range(10):
+                self.server.step()
+        self.server.step()
+        self.assertIn(acked, self.server.history)
+        await self.receive(self.spectator)
+        self.assertEqual(self.spectator.tick, self.server.tick)
+        self.assert_in_sync(self.spectator)
+
+    async def test_full_snapshot_after_history_is_evicted(self):
+        await self.step(5)
+        acked = self.get_state(self.spectator).acked
+        with mock.patch.object(server, 'MAX_CLIENT_BUFFER', -1):
+            for _ in range(netcode.HISTORY_SIZE + 1):
+                self.server.step()
+        self.assertNotIn(acked, self.server.history)
+        self.server.step()
+        await self.receive(self.spectator)
+        self.assertEqual(self.spectator.tick, self.server.tick)
+        self.assert_in_sync(self.spectator)
+
+
+class HeadlessCanvasTest(unittest.TestCase):
+    def test_unsupported_method_is_named(self):
+        field = server.HeadlessGame().field
+        self.assertIn('HeadlessField', repr(field))
+        with self.assertRaisesRegex(NotImplementedError, 'find overlapping'):
+            field.find_overlapping(0, 0, 1, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
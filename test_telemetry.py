@@ -0,0 +1,112 @@
+"""Tests of `telemetry.Telemetry` aggregates and its writer."""
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import telemetry
+
+
+class AggregateTest(unittest.TestCase):
+    def setUp(self):
+        self.telemetry = telemetry.Telemetry(power_bucket=10, window=2)
+
+    def test_shots_per_round(self):
+        for number in range(1, 4):
+            self.telemetry.shot(number, 15, 0.5, number)
+        self.telemetry.round_end(10, 3, 0)
+        self.telemetry.shot(11, 15, 0.5, 4)
+        self.telemetry.round_end(20, 1, 0)
+        self.assertEqual(self.telemetry.shots_per_round(), [3, 1])
+
+    def test_window(self):
+        for shots in (1, 2, 3):
+            for _ in range(shots):
+                self.telemetry.shot(0, 15, 0.5, 1)
+            self.telemetry.round_end(0, shots, 0)
+        self.assertEqual(self.telemetry.shots_per_round(), [2, 3])
+
+    def test_hit_rate_by_power(self):
+        self.telemetry.shot(1, 12, 0.5, 1)
+        self.telemetry.shot(2, 18, 0.5, 2)
+        self.telemetry.shot(3, 35, 0.5, 3)
+        # A bullet that hits two targets is counted once.
+        self.telemetry.hit(4, 1, [0, 0, 10])
+        self.telemetry.hit(4, 1, [5, 5, 10])
+        self.telemetry.hit(5, 3, [0, 0, 10])
+        self.assertEqual(self.telemetry.hit_rate_by_power(), {10: 0.5, 30: 1.0})
+
+    def test_abandoned_round_is_not_counted(self):
+        self.telemetry.shot(1, 15, 0.5, 1)
+        self.telemetry.round_end(2, 1, 0)
+        self.telemetry.shot(3, 45, 0.5, 1)
+        self.telemetry.hit(4, 1, [0, 0, 10])
+        self.telemetry.abandon_round(5)
+        self.assertEqual(self.telemetry.shots_per_round(), [1])
+        self.assertEqual(self.telemetry.hit_rate_by_power(), {10: 0.0})
+
+
+class WriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'events.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_events(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_events_are_written_on_close(self):
+        game_telemetry = telemetry.Telemetry(self.path)
+        game_telemetry.shot(1, 15, 0.5, 1)
+        game_telemetry.pause()
+        game_telemetry.close()
+        self.assertEqual([e['event'] for e in self.read_events()], ['shot', 'pause'])
+
+    def test_ring_buffer_drops_oldest(self):
+        # The writer thread finds nothing to write while `flush` is patched.
+        with mock.patch.object(telemetry.Telemetry, 'flush'):
+            game_telemetry = telemetry.Telemetry(self.path, capacity=4)
+            for number in range(1, 7):
+                game_telemetry.shot(number, 15, 0.5, number)
+        game_telemetry.close()
+        self.assertEqual(game_telemetry.dropped, 2)
+        self.assertEqual([e['bullet_number'] for e in self.read_events()], [3, 4, 5, 6])
+
+    def test_empty_round_is_not_abandoned(self):
+        game_telemetry = telemetry.Telemetry(self.path)
+        game_telemetry.abandon_round(0)
+        game_telemetry.shot(1, 15, 0.5, 1)
+        game_telemetry.abandon_round(2)
+        game_telemetry.close()
+        events = self.read_events()
+        self.assertEqual([e['event'] for e in events], ['shot', 'round_end'])
+        self.assertTrue(events[1]['abandoned'])
+
+    def test_emit_after_close_is_ignored(self):
+        game_telemetry = telemetry.Telemetry(self.path)
+        game_telemetry.shot(1, 15, 0.5, 1)
+        game_telemetry.close()
+        game_telemetry.shot(2, 15, 0.5, 2)
+        game_telemetry.flush()
+        self.assertEqual(len(self.read_events()), 1)
+        self.assertEqual(len(game_telemetry.buffer), 0)
+
+    def test_write_error_is_reported(self):
+        # The path is a directory, so every write fails.
+        game_telemetry = telemetry.Telemetry(self.directory.name, flush_interval=0.01)
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            game_telemetry.shot(1, 15, 0.5, 1)
+            game_telemetry.close()
+        self.assertEqual(game_telemetry.dropped, 1)
+        self.assertIn('could not write', stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()